@@ -0,0 +1,46 @@
+"""SQL issued by the activity stubs.
+
+Each statement lives here once, so every call site sends byte-identical text
+and asyncpg's per-connection statement cache (keyed by query text) prepares
+it once and reuses it after that.
+"""
+from typing import Final
+
+_SQL_ORDER_EXISTS: Final[str] = "SELECT 1 FROM orders WHERE id = $1"
+
+_SQL_SELECT_ITEMS: Final[str] = "SELECT items_json FROM orders WHERE id = $1"
+
+_SQL_INSERT_ORDER: Final[str] = """
+    INSERT INTO orders (id, state, items_json, address_json, created_at, updated_at)
+    VALUES ($1, $2, $3, $4, NOW(), NOW())
+    ON CONFLICT (id) DO UPDATE SET updated_at = NOW()
+    RETURNING items_json, address_json, (xmax = 0) AS inserted
+"""
+
+_SQL_TRANSITION: Final[str] = """
+    WITH prev AS (
+        SELECT state FROM orders WHERE id = $2
+    )
+    UPDATE orders SET state = $1, updated_at = NOW()
+    FROM prev
+    WHERE orders.id = $2 AND orders.state IS DISTINCT FROM $1
+    RETURNING prev.state
+"""
+
+_SQL_UPDATE_ADDRESS: Final[str] = """
+    WITH prev AS (
+        SELECT address_json FROM orders WHERE id = $1
+    )
+    UPDATE orders SET address_json = $2, updated_at = NOW()
+    FROM prev
+    WHERE orders.id = $1 AND orders.address_json IS DISTINCT FROM $2::jsonb
+    RETURNING prev.address_json
+"""
+
+_SQL_SELECT_PAYMENT: Final[str] = "SELECT payment_id, order_id, status, amount FROM payments WHERE payment_id = $1"
+
+_SQL_INSERT_PAYMENT: Final[str] = """
+    INSERT INTO payments(payment_id, order_id, status, amount, created_at)
+    VALUES ($1, $2, $3, $4, NOW())
+    ON CONFLICT (payment_id) DO NOTHING
+"""
@@ -1,133 +1,215 @@
-import asyncio, random, json, logging, uuid
-from typing import Dict, Any
+import array, asyncio, itertools, operator, random, logging, uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+from config import settings
 from db.session import get_db_pool
+from db.event_writer import get_event_writer
+from activities._sql import (
+    _SQL_ORDER_EXISTS,
+    _SQL_SELECT_ITEMS,
+    _SQL_INSERT_ORDER,
+    _SQL_TRANSITION,
+    _SQL_UPDATE_ADDRESS,
+    _SQL_SELECT_PAYMENT,
+    _SQL_INSERT_PAYMENT,
+)
 
 logger = logging.getLogger(__name__)
 
+# Namespace for deterministic event IDs; see _event_id.
+_NS = uuid.UUID("7a0cbb83-7784-4796-8ee6-adffa76f6b60")
+
+
+class ValidationError(ValueError):
+    """The order itself is invalid; retrying the activity cannot succeed."""
+
+
+# Quantity of a cart item; items without one count once.
+_get_qty = operator.methodcaller("get", "qty", 1)
+
+
+@dataclass(slots=True, frozen=True)
+class Order:
+    """The order payload the workflows pass to activities, unpacked once per call.
+
+    Once an order is persisted the workflows send only its order_id; items is
+    then None and activities that need it read it back with _load_items.
+    """
+    order_id: str
+    items: Optional[List[Dict[str, Any]]]
+    address: Optional[Dict[str, Any]]
+
+    @classmethod
+    def from_dict(cls, order: Dict[str, Any]) -> "Order":
+        return cls(order["order_id"], order.get("items"), order.get("address"))
+
+
+_FLAKY = settings.flaky_enabled
+
+# Pre-drawn samples for flaky_call, read round-robin so each call is an array
+# index rather than an RNG call. The size is a power of two so the index wraps
+# with a mask.
+_RAND_SIZE = 65536
+_RAND = array.array("d", (random.random() for _ in range(_RAND_SIZE))) if _FLAKY else None
+_rand_idx = itertools.count()
+
+
 async def flaky_call() -> None:
-    """Either raise an error or sleep long enough to trigger an activity timeout."""
-    rand_num = random.random()
+    """Either raise an error or sleep long enough to trigger an activity timeout.
+
+    A no-op unless FLAKY_ENABLED is set (the default, for the demo).
+    """
+    if not _FLAKY:
+        return
+
+    rand_num = _RAND[next(_rand_idx) & (_RAND_SIZE - 1)]
     if rand_num < 0.33:
         raise RuntimeError("Forced failure for testing")
 
     if rand_num < 0.67:
         await asyncio.sleep(300)  # Expect the activity layer to time out before this completes
-        
 
-async def order_received(order: Dict[str, Any]) -> Dict[str, Any]:
-    await flaky_call()
 
-    order_id = order.get("order_id")
-    items = order.get("items", [])
-    address = order.get("address")
+@asynccontextmanager
+async def _connection(db):
+    """Use the caller's connection if given, otherwise hold one from the pool for the call."""
+    if db is not None:
+        yield db
+    else:
+        async with get_db_pool().acquire() as conn:
+            yield conn
 
-    logger.info(f"Order {order_id} received with items={items} and address={address}")
 
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
+def _event_id(order_id: str, event_type: str, state: str) -> str:
+    """Stable event ID, so a retried activity cannot record the same event twice."""
+    return str(uuid.uuid5(_NS, f"{order_id}:{event_type}:{state}"))
 
-        existing_order = await conn.fetchrow(
-            "SELECT id, state, items_json, address_json FROM orders WHERE id = $1",
-            order_id
-        )
-        
-        if existing_order:
-            logger.info(f"Order {order_id} already exists")
-            return {
-                "order_id": order_id,
-                "items": json.loads(existing_order['items_json']) if existing_order['items_json'] else items,
-                "address": json.loads(existing_order['address_json']) if existing_order['address_json'] else address
-            }
 
-        await conn.execute("""
-            INSERT INTO orders (id, state, items_json, address_json, created_at, updated_at) 
-            VALUES ($1, $2, $3, $4, NOW(), NOW())
-            ON CONFLICT (id) DO NOTHING
-        """,
-        order_id,
-        "ORDER_RECEIVED",
-        json.dumps(items),
-        json.dumps(address) if address else None
-        )
+async def _transition(conn, order_id: str, new_state: str, event_type: str, payload: Dict[str, Any]) -> Optional[str]:
+    """Move an order to new_state and queue its event.
 
-        await conn.execute("""
-            INSERT INTO events (id, order_id, type, payload_json, timestamp)
-            VALUES ($1, $2, $3, $4, NOW())
-        """,
-        str(uuid.uuid4()),
+    Returns the state the order moved from. The state guard makes the call
+    idempotent: when the order is already in new_state nothing is written and
+    None is returned.
+    """
+    previous_state = await conn.fetchval(_SQL_TRANSITION, new_state, order_id)
+
+    if previous_state is None:
+        if await conn.fetchval(_SQL_ORDER_EXISTS, order_id) is None:
+            logger.error("Order %s not found", order_id)
+            raise ValueError(f"Order {order_id} not found")
+        return None
+
+    await get_event_writer().append(
+        _event_id(order_id, event_type, new_state),
         order_id,
-        "ORDER_RECEIVED",
-        json.dumps({"items": items, "address": address, "state": "ORDER_RECEIVED"})
-        )
+        event_type,
+        {**payload, "previous_state": previous_state}
+    )
+    return previous_state
 
-        logger.info(f"Order {order_id} successfully received and persisted to DB")
 
-    return {"order_id": order_id, "items": items, "address": address}
+async def _load_items(conn, order: Order) -> List[Dict[str, Any]]:
+    """The order's items, from the payload if it carried them, else from the DB."""
+    if order.items is not None:
+        return order.items
 
-async def order_validated(order: Dict[str, Any]) -> bool:
+    row = await conn.fetchrow(_SQL_SELECT_ITEMS, order.order_id)
+    if row is None:
+        logger.error("Order %s not found", order.order_id)
+        raise ValueError(f"Order {order.order_id} not found")
+    return row["items_json"] or []
+
+
+async def _record_transition(order: Order, new_state: str, done: str, db=None) -> str:
+    """Shared body of the activities that only move the order to new_state.
+
+    `done` completes the log lines, e.g. "shipped".
+    """
     await flaky_call()
 
-    order_id = order.get("order_id")
-    items = order.get("items", [])
+    order_id = order.order_id
+    async with _connection(db) as conn:
+        moved_from = await _transition(conn, order_id, new_state, new_state, {"state": new_state})
 
-    if not items:
-        raise ValueError("No items to validate")
+    if moved_from is None:
+        logger.info("Order %s already %s", order_id, done)
+    else:
+        logger.info("Order %s successfully %s", order_id, done)
 
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        existing_order = await conn.fetchrow(
-            "SELECT id, state, items_json, address_json FROM orders WHERE id = $1",
-            order_id
-        )
+    return new_state
 
-        if not existing_order:
-            logger.error(f"Order {order_id} not found")
-            raise ValueError(f"Order {order_id} not found")
 
-        if existing_order['state'] == "ORDER_VALIDATED":
-            logger.info(f"Order {order_id} already validated")
-            return True
-        await conn.execute("""
-            UPDATE orders SET state = $1, updated_at = NOW() WHERE id = $2
-            """,
-            "ORDER_VALIDATED",
-            order_id
+async def order_received(order: Order, db=None) -> Dict[str, Any]:
+    await flaky_call()
+
+    order_id = order.order_id
+    items = order.items or []
+    address = order.address
+
+    logger.info("Order %s received with items=%s and address=%s", order_id, items, address)
+
+    async with _connection(db) as conn:
+        # One round-trip either way: the upsert hands back the stored row, and
+        # xmax = 0 only holds for a freshly inserted tuple.
+        row = await conn.fetchrow(
+            _SQL_INSERT_ORDER,
+            order_id,
+            "ORDER_RECEIVED",
+            items,
+            address or None
         )
 
-        await conn.execute("""
-            INSERT INTO events (id, order_id, type, payload_json, timestamp)
-            VALUES ($1, $2, $3, $4, NOW())
-        """,
-        str(uuid.uuid4()),
-        order_id,
-        "ORDER_VALIDATED",
-        json.dumps({
-            "state": "ORDER_VALIDATED",
-            "previous_state": existing_order['state']
-        })
+        if not row["inserted"]:
+            logger.info("Order %s already exists", order_id)
+            return {
+                "order_id": order_id,
+                "items": row['items_json'] or items,
+                "address": row['address_json'] or address
+            }
+
+        await get_event_writer().append(
+            _event_id(order_id, "ORDER_RECEIVED", "ORDER_RECEIVED"),
+            order_id,
+            "ORDER_RECEIVED",
+            {"items": items, "address": address or None, "state": "ORDER_RECEIVED"}
         )
 
-        logger.info(f"Order {order_id} successfully validated")
+        logger.info("Order %s successfully received and persisted to DB", order_id)
+
+    return {"order_id": order_id, "items": items, "address": address}
+
+async def order_validated(order: Order, db=None) -> bool:
+    await flaky_call()
+
+    order_id = order.order_id
+    async with _connection(db) as conn:
+        if not await _load_items(conn, order):
+            raise ValidationError("No items to validate")
+
+        moved_from = await _transition(conn, order_id, "ORDER_VALIDATED", "ORDER_VALIDATED", {"state": "ORDER_VALIDATED"})
+
+    if moved_from is None:
+        logger.info("Order %s already validated", order_id)
+    else:
+        logger.info("Order %s successfully validated", order_id)
 
     return True
 
-async def payment_charged(order: Dict[str, Any], payment_id: str, db) -> Dict[str, Any]:
+async def payment_charged(order: Order, payment_id: str, db=None) -> Dict[str, Any]:
     """Charge payment after simulating an error/timeout first.
     You must implement your own idempotency logic in the activity or here.
     """
     await flaky_call()
-    
-    order_id = order.get("order_id")
-
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        existing_payment = await conn.fetchrow(
-            "SELECT payment_id, order_id, status, amount FROM payments WHERE payment_id = $1",
-            payment_id
-        )
+
+    order_id = order.order_id
+
+    async with _connection(db) as conn:
+        existing_payment = await conn.fetchrow(_SQL_SELECT_PAYMENT, payment_id)
 
         if existing_payment:
-            logger.info(f"Payment {payment_id} already charged")
+            logger.info("Payment %s already charged", payment_id)
             return {
                 "payment_id": payment_id,
                 "order_id": order_id,
@@ -135,213 +217,64 @@ async def payment_charged(order: Dict[str, Any], payment_id: str, db) -> Dict[st
                 "amount": float(existing_payment['amount'])
             }
 
-        amount = sum(i.get("qty", 1) for i in order.get("items", []))
+        amount = sum(map(_get_qty, await _load_items(conn, order)))
 
-        await conn.execute("""
-                INSERT INTO payments(payment_id, order_id, status, amount, created_at)
-                VALUES ($1, $2, $3, $4, NOW())
-                ON CONFLICT (payment_id) DO NOTHING
-            """,
+        await conn.execute(
+            _SQL_INSERT_PAYMENT,
             payment_id,
             order_id,
             "CHARGED",
             amount
-            )
-        await conn.execute("""
-            UPDATE orders SET state = $1, updated_at = NOW() WHERE id = $2
-            """,
-            "PAYMENT_CHARGED",
-            order_id
         )
-
-        await conn.execute("""
-            INSERT INTO events (id, order_id, type, payload_json, timestamp)
-            VALUES ($1, $2, $3, $4, NOW())
-        """,
-        str(uuid.uuid4()),
-        order_id,
-        "PAYMENT_CHARGED",
-        json.dumps({
+        await _transition(conn, order_id, "PAYMENT_CHARGED", "PAYMENT_CHARGED", {
             "payment_id": payment_id,
             "amount": amount,
             "status": "PAYMENT_CHARGED"
         })
-        )
 
-        logger.info(f"Payment {payment_id} successfully charged")
+        logger.info("Payment %s successfully charged", payment_id)
 
     return {
         "payment_id": payment_id,
         "order_id": order_id,
-        "status": "CHARGED", 
+        "status": "CHARGED",
         "amount": amount
         }
 
-async def order_shipped(order: Dict[str, Any]) -> str:
-    await flaky_call()
-    
-    order_id = order.get("order_id")
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        existing_order = await conn.fetchrow(
-            "SELECT id, state, items_json, address_json FROM orders WHERE id = $1",
-            order_id
-        )
-
-        if not existing_order:
-            logger.error(f"Order {order_id} not found")
-            raise ValueError(f"Order {order_id} not found")
-        
-        if existing_order['state'] == "ORDER_SHIPPED":
-            logger.info(f"Order {order_id} already shipped")
-            return "ORDER_SHIPPED"
-        
-        await conn.execute("""
-            UPDATE orders SET state = $1, updated_at = NOW() WHERE id = $2
-            """,
-            "ORDER_SHIPPED",
-            order_id
-        )
-
-        await conn.execute("""
-            INSERT INTO events (id, order_id, type, payload_json, timestamp)
-            VALUES ($1, $2, $3, $4, NOW())
-            """,
-            str(uuid.uuid4()),
-            order_id,
-            "ORDER_SHIPPED",
-            json.dumps({
-                "state": "ORDER_SHIPPED",
-                "previous_state": existing_order['state']
-            })
-        )
-
-        logger.info(f"Order {order_id} successfully shipped")
+async def order_shipped(order: Order, db=None) -> str:
+    return await _record_transition(order, "ORDER_SHIPPED", "shipped", db)
 
-    return "ORDER_SHIPPED"
+async def package_prepared(order: Order, db=None) -> str:
+    return await _record_transition(order, "PACKAGE_PREPARED", "prepared", db)
 
-async def package_prepared(order: Dict[str, Any]) -> str:
-    await flaky_call()
-    
-    order_id = order.get("order_id")
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        existing_order = await conn.fetchrow(
-            "SELECT id, state, items_json, address_json FROM orders WHERE id = $1",
-            order_id
-        )
-
-        if not existing_order:
-            logger.error(f"Order {order_id} not found")
-            raise ValueError(f"Order {order_id} not found")
-
-        if existing_order['state'] == "PACKAGE_PREPARED":
-            logger.info(f"Order {order_id} already prepared")
-            return "PACKAGE_PREPARED"
-
-        await conn.execute("""
-            UPDATE orders SET state = $1, updated_at = NOW() WHERE id = $2
-            """,
-            "PACKAGE_PREPARED",
-            order_id
-        )
-
-        await conn.execute("""
-            INSERT INTO events (id, order_id, type, payload_json, timestamp)
-            VALUES ($1, $2, $3, $4, NOW())
-            """,
-            str(uuid.uuid4()),
-            order_id,
-            "PACKAGE_PREPARED",
-            json.dumps({
-                "state": "PACKAGE_PREPARED",
-                "previous_state": existing_order['state']
-            })
-        )
-
-        logger.info(f"Order {order_id} successfully prepared")
-
-    return "PACKAGE_PREPARED"
+async def carrier_dispatched(order: Order, db=None) -> str:
+    return await _record_transition(order, "CARRIER_DISPATCHED", "dispatched", db)
 
-async def carrier_dispatched(order: Dict[str, Any]) -> str:
+async def update_order_address(order_id: str, address: dict, db=None) -> None:
     await flaky_call()
-    
-    order_id = order.get("order_id")
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        existing_order = await conn.fetchrow(
-            "SELECT id, state, items_json, address_json FROM orders WHERE id = $1",
-            order_id
-        )
 
-        if not existing_order:
-            logger.error(f"Order {order_id} not found")
-            raise ValueError(f"Order {order_id} not found")
-        
-        if existing_order['state'] == "CARRIER_DISPATCHED":
-            logger.info(f"Order {order_id} already dispatched")
-            return "CARRIER_DISPATCHED"
-        
-        await conn.execute("""
-            UPDATE orders SET state = $1, updated_at = NOW() WHERE id = $2
-            """,
-            "CARRIER_DISPATCHED",
-            order_id
-        )
+    logger.info("Updating address for order %s", order_id)
 
-        await conn.execute("""
-            INSERT INTO events (id, order_id, type, payload_json, timestamp)
-            VALUES ($1, $2, $3, $4, NOW())
-            """,
-            str(uuid.uuid4()),
-            order_id,
-            "CARRIER_DISPATCHED",
-            json.dumps({
-                "state": "CARRIER_DISPATCHED",
-                "previous_state": existing_order['state']
-            })
-        )
+    async with _connection(db) as conn:
+        # fetchrow rather than fetchval: the previous address may itself be NULL
+        updated = await conn.fetchrow(_SQL_UPDATE_ADDRESS, order_id, address)
 
-        logger.info(f"Order {order_id} successfully dispatched")
+        if updated is None:
+            if await conn.fetchval(_SQL_ORDER_EXISTS, order_id) is None:
+                logger.error("Order %s not found", order_id)
+                raise ValueError(f"Order {order_id} not found")
 
-    return "CARRIER_DISPATCHED"
+            logger.info("Address for order %s already up to date", order_id)
+            return
 
-async def update_order_address(order_id: str, address: dict) -> None:
-    await flaky_call()
-    
-    logger.info(f"Updating address for order {order_id}")
-    
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        existing_order = await conn.fetchrow(
-            "SELECT id, address_json FROM orders WHERE id = $1",
-            order_id
-        )
-        
-        if not existing_order:
-            logger.error(f"Order {order_id} not found")
-            raise ValueError(f"Order {order_id} not found")
-        
-        old_address = json.loads(existing_order['address_json']) if existing_order['address_json'] else None
-        
-        await conn.execute("""
-            UPDATE orders SET address_json = $1, updated_at = NOW() WHERE id = $2
-        """,
-        json.dumps(address),
-        order_id
-        )
-        
-        await conn.execute("""
-            INSERT INTO events (id, order_id, type, payload_json, timestamp)
-            VALUES ($1, $2, $3, $4, NOW())
-        """,
+    # Not derived via _event_id: an address can legitimately be set back to
+    # an earlier value. Retries are already no-ops through the
+    # IS DISTINCT FROM guard in the statement.
+    await get_event_writer().append(
         str(uuid.uuid4()),
         order_id,
         "ADDRESS_UPDATED",
-        json.dumps({
-            "old_address": old_address,
-            "new_address": address
-        })
-        )
-    
-    logger.info(f"Address updated for order {order_id}")
+        {"old_address": updated["address_json"], "new_address": address}
+    )
+
+    logger.info("Address updated for order %s", order_id)
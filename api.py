@@ -4,26 +4,31 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from temporalio.client import Client
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict
 from config import settings
+from temporal_client import get_temporal_client
 from workflows.order_workflow import OrderWorkflow
 import uuid
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.state.temporal_client = await Client.connect(settings.temporal_address)
+    app.state.temporal_client = await get_temporal_client()
     yield
-    if hasattr(app.state, "temporal_client"):
-        await app.state.temporal_client.close()
 
 app = FastAPI(title="Temporal Order Lifecycle API", lifespan=lifespan)
 
+class OrderItem(BaseModel):
+    # sku and any other item fields are passed through untouched
+    model_config = ConfigDict(extra="allow")
+
+    qty: int = 1
+
 class OrderRequest(BaseModel):
     payment_id: str
-    items: List[Dict[str, Any]]
+    items: List[OrderItem]
     address: Optional[Dict[str, str]] = None
 
 class AddressUpdate(BaseModel):
@@ -36,7 +41,7 @@ async def start_order_workflow(order_id: str, request: OrderRequest):
     try:
         handle = await client.start_workflow(
             OrderWorkflow.run,
-            args=[order_id, request.payment_id, request.items, request.address],
+            args=[order_id, request.payment_id, [i.model_dump() for i in request.items], request.address],
             id=order_id,
             task_queue=settings.order_tq,
         )
@@ -0,0 +1,29 @@
+"""One-shot database setup: create the orders database if it is missing.
+
+Run with `python -m db.bootstrap`, or set DB_BOOTSTRAP=1 to have the workers
+do it before connecting.
+"""
+import asyncio
+import asyncpg
+from config import settings
+
+
+async def create_database():
+    """Create the orders database if it doesn't exist."""
+    try:
+        # Connect to default postgres database to create orders db
+        default_db_url = settings.asyncpg_url.rsplit('/', 1)[0] + '/postgres'
+        conn = await asyncpg.connect(default_db_url)
+        try:
+            await conn.execute('CREATE DATABASE orders')
+            print("Created 'orders' database")
+        except asyncpg.DuplicateDatabaseError:
+            pass  # Database already exists
+        finally:
+            await conn.close()
+    except Exception as e:
+        print(f"Note: Could not create database (may already exist): {e}")
+
+
+if __name__ == "__main__":
+    asyncio.run(create_database())
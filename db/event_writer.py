@@ -0,0 +1,196 @@
+"""Write-behind buffer for the events table.
+
+Activities commit the order/payment change inline and hand the matching event
+to the writer, which batches them and lands each batch with a single COPY.
+"""
+import asyncio
+import contextlib
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+import asyncpg
+import orjson
+
+from db.session import connect
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = ("id", "order_id", "type", "payload_json", "timestamp")
+
+# COPY cannot skip conflicting rows, so batches go through a session-local
+# staging table and are moved over with ON CONFLICT, keeping a retried
+# activity's event a no-op.
+_CREATE_STAGE = """
+    CREATE TEMP TABLE IF NOT EXISTS events_stage (
+        id VARCHAR(255),
+        order_id VARCHAR(255),
+        type VARCHAR(255),
+        payload_json JSONB,
+        timestamp TIMESTAMPTZ
+    ) ON COMMIT DELETE ROWS
+"""
+_MOVE_STAGE = """
+    INSERT INTO events (id, order_id, type, payload_json, timestamp)
+    SELECT id, order_id, type, payload_json, timestamp FROM events_stage
+    ON CONFLICT (id) DO NOTHING
+"""
+
+# Failures _write retries until the database is reachable again
+_CONNECTION_ERRORS = (
+    OSError,
+    asyncpg.InterfaceError,
+    asyncpg.PostgresConnectionError,
+    # Raised while the server shuts down or is still starting up
+    asyncpg.OperatorInterventionError,
+)
+
+# Global writer
+_writer: Optional["EventWriter"] = None
+
+
+class EventWriter:
+    """Buffers events in a queue and flushes them every flush_interval seconds or max_batch rows."""
+
+    def __init__(self, max_batch: int = 500, flush_interval: float = 0.01, max_pending: int = 10_000, max_backoff: float = 5.0):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        # Bounded so a stalled database applies backpressure to the activities
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._conn: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        # Events taken off the queue by the flusher but not yet written
+        self._in_flight = 0
+
+    async def start(self):
+        await self._connect()
+        self._task = asyncio.create_task(self._flusher())
+
+    async def append(self, event_id: str, order_id: str, event_type: str, payload: Dict[str, Any]):
+        """Queue an event; it is written on the next flush.
+
+        The payload is encoded here, so a payload that cannot be stored fails
+        the calling activity, which is retried, rather than a later flush.
+        """
+        if self._task is None or self._task.done():
+            raise RuntimeError("Event writer is not running")
+        data = orjson.dumps(payload)
+        await self._queue.put((event_id, order_id, event_type, data, datetime.now(timezone.utc)))
+
+    async def close(self, timeout: float = 5.0):
+        """Flush everything queued so far, then stop.
+
+        Gives up after timeout seconds, e.g. while the database is down, so
+        shutdown cannot hang; the events still queued then are logged as lost.
+        """
+        if self._task is None:
+            return
+        # Wait for the queue to drain, unless the flusher has died and never will
+        drained = asyncio.ensure_future(self._queue.join())
+        await asyncio.wait((drained, self._task), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        drained.cancel()
+        unwritten = self._queue.qsize() + self._in_flight
+        if self._task.done():
+            if not self._task.cancelled() and self._task.exception() is not None:
+                logger.error("Event flusher died; %s events not written", unwritten, exc_info=self._task.exception())
+        else:
+            if unwritten:
+                logger.error("Event flush did not finish within %ss; %s events not written", timeout, unwritten)
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        self._task = None
+        if self._conn is not None:
+            if unwritten:
+                self._conn.terminate()  # the database may be unreachable
+            else:
+                await self._conn.close()
+            self._conn = None
+
+    async def _connect(self):
+        # A dedicated connection rather than a pool slot: the pool is sized to
+        # the activity concurrency, and activities wait on this queue when it
+        # is full.
+        self._conn = await connect()
+        # Payloads arrive already encoded by append()
+        await self._conn.set_type_codec(
+            "jsonb",
+            encoder=lambda v: b"\x01" + v,  # binary jsonb is prefixed with a version byte
+            decoder=lambda v: v[1:],
+            schema="pg_catalog",
+            format="binary",
+        )
+        await self._conn.execute(_CREATE_STAGE)
+
+    async def _flusher(self):
+        while True:
+            batch = [await self._queue.get()]
+            # Give concurrent activities a moment to add to the batch
+            await asyncio.sleep(self.flush_interval)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            self._in_flight = len(batch)
+            try:
+                await self._write(batch)
+            except Exception as e:
+                # Not a connection problem: find the rows at fault and keep the rest
+                logger.warning("Event flush of %s rows failed, retrying row by row: %s", len(batch), e)
+                await self._write_each(batch)
+            finally:
+                self._in_flight = 0
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_each(self, batch):
+        for row in batch:
+            try:
+                await self._write([row])
+            except Exception:
+                logger.exception("Dropping event %s for order %s", row[0], row[1])
+
+    async def _write(self, batch):
+        # The activities' state guards make their retries no-ops, so nothing
+        # would re-send these events: keep retrying through a database outage
+        # while the bounded queue holds the activities back.
+        attempt = 0
+        while True:
+            try:
+                if self._conn is None or self._conn.is_closed():
+                    await self._connect()
+                async with self._conn.transaction():
+                    await self._conn.copy_records_to_table("events_stage", records=batch, columns=_COLUMNS)
+                    await self._conn.execute(_MOVE_STAGE)
+                return
+            except _CONNECTION_ERRORS as e:
+                attempt += 1
+                logger.warning("Event flush of %s rows failed (attempt %s): %s", len(batch), attempt, e)
+                if self._conn is not None:
+                    self._conn.terminate()  # reconnect on the next attempt
+                await asyncio.sleep(min(self.flush_interval * 2 ** attempt, self.max_backoff))
+
+
+async def start_event_writer():
+    """Start the global event writer."""
+    global _writer
+    if _writer is None:
+        writer = EventWriter()
+        await writer.start()
+        _writer = writer
+    return _writer
+
+
+def get_event_writer() -> EventWriter:
+    """Get the global event writer."""
+    if _writer is None:
+        raise RuntimeError("Event writer is not started; call start_event_writer() at startup")
+    return _writer
+
+
+async def close_event_writer(timeout: float = 5.0):
+    """Flush pending events and stop the global event writer."""
+    global _writer
+    if _writer:
+        await _writer.close(timeout)
+        _writer = None
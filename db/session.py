@@ -1,5 +1,6 @@
 """Database connection pool using asyncpg."""
 import asyncpg
+import orjson
 from typing import Optional
 from config import settings
 
@@ -7,44 +8,53 @@ from config import settings
 _pool: Optional[asyncpg.Pool] = None
 
 
-async def init_db_pool():
+async def _init_conn(conn: asyncpg.Connection):
+    """Exchange jsonb in binary form so Python objects map straight to columns."""
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=lambda v: b"\x01" + orjson.dumps(v),  # binary jsonb is prefixed with a version byte
+        decoder=lambda v: orjson.loads(v[1:]),
+        schema="pg_catalog",
+        format="binary",
+    )
+
+
+async def init_db_pool(size: int = settings.db_pool_size):
     """Initialize the database connection pool."""
     global _pool
     if _pool is None:
-        # Convert SQLAlchemy URL to asyncpg format
-        db_url = settings.database_url.replace("postgresql+asyncpg://", "postgresql://")
-        
-        # Try to create the orders database if it doesn't exist
-        try:
-            # Connect to default postgres database to create orders db
-            default_db_url = db_url.rsplit('/', 1)[0] + '/postgres'
-            conn = await asyncpg.connect(default_db_url)
-            try:
-                await conn.execute('CREATE DATABASE orders')
-                print("Created 'orders' database")
-            except asyncpg.DuplicateDatabaseError:
-                pass  # Database already exists
-            finally:
-                await conn.close()
-        except Exception as e:
-            print(f"Note: Could not create database (may already exist): {e}")
-        
         _pool = await asyncpg.create_pool(
-            db_url,
-            min_size=10,
-            max_size=30,
-            command_timeout=5,
+            settings.asyncpg_url,
+            # Fixed size, matched to the worker's activity concurrency, so
+            # bursts never wait on new connections being established.
+            min_size=size,
+            max_size=size,
             statement_cache_size=100,
             max_cached_statement_lifetime=300,
-            max_cacheable_statement_size=1024 * 15
+            max_cacheable_statement_size=1024 * 15,
+            init=_init_conn
         )
     return _pool
 
 
-async def get_db_pool() -> asyncpg.Pool:
-    """Get the database connection pool."""
+async def connect() -> asyncpg.Connection:
+    """Open a standalone connection, set up like the pooled ones.
+
+    For long-lived background tasks that should not hold a pool slot.
+    """
+    conn = await asyncpg.connect(settings.asyncpg_url)
+    await _init_conn(conn)
+    return conn
+
+
+def get_db_pool() -> asyncpg.Pool:
+    """Get the database connection pool.
+
+    The workers create the pool at startup, so this is a plain lookup on the
+    activity hot path rather than an await.
+    """
     if _pool is None:
-        await init_db_pool()
+        raise RuntimeError("Database pool is not initialized; call init_db_pool() at startup")
     return _pool
 
 
@@ -58,7 +68,7 @@ async def close_db_pool():
 
 async def init_schema():
     """Initialize database schema from schema.sql file."""
-    pool = await get_db_pool()
+    pool = get_db_pool()
     
     # Read schema file
     with open("db/schema.sql", "r") as f:
@@ -0,0 +1,115 @@
+"""Process-wide Temporal client."""
+import asyncio
+import dataclasses
+import math
+import re
+from typing import Any, Optional, Type
+
+import orjson
+from temporalio.api.common.v1 import Payload
+from temporalio.client import Client
+from temporalio.converter import (
+    AdvancedJSONEncoder,
+    CompositePayloadConverter,
+    DataConverter,
+    DefaultPayloadConverter,
+    JSONPlainPayloadConverter,
+    value_to_type,
+)
+from config import settings
+
+# Global client
+_client: Optional[Client] = None
+_lock = asyncio.Lock()
+
+
+class OrjsonPlainPayloadConverter(JSONPlainPayloadConverter):
+    """The stock "json/plain" converter, with orjson doing the (de)serialization.
+
+    Payloads stay plain JSON, so histories, the UI and other SDKs read them as
+    before. Values orjson would write differently (non-ASCII text, NaN and
+    infinities, integers beyond 64 bits, non-str keys) or that the stock
+    encoder rejects go through the stock converter instead. The only remaining
+    difference is float exponents (1e16 rather than 1e+16), which decode to
+    the same value.
+    """
+
+    # Dataclasses, datetimes and str/int/dict/list subclasses are left to the
+    # stock encoder's default(), which handles or rejects them as before
+    _OPTIONS = (
+        orjson.OPT_SORT_KEYS
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_SUBCLASS
+    )
+    # Same fallbacks as the default encoder (objects with dict(), iterables)
+    _default = staticmethod(AdvancedJSONEncoder().default)
+
+    def to_payload(self, value: Any) -> Optional[Payload]:
+        try:
+            data = orjson.dumps(value, default=self._default, option=self._OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().to_payload(value)
+        # orjson writes non-ASCII as raw UTF-8 and non-finite floats as null;
+        # both are rare enough to check only when they may be present
+        if not data.isascii() or (b"null" in data and _may_hold_non_finite(value)):
+            return super().to_payload(value)
+        return Payload(metadata={"encoding": self.encoding.encode()}, data=data)
+
+    def from_payload(self, payload: Payload, type_hint: Optional[Type] = None) -> Any:
+        # orjson rejects the NaN/Infinity and lone surrogates the stock encoder
+        # writes, and reads integers beyond 64 bits as floats; those payloads
+        # are parsed by the stock decoder instead
+        if _MAYBE_BIG_INT.search(payload.data):
+            return super().from_payload(payload, type_hint)
+        try:
+            obj = orjson.loads(payload.data)
+        except orjson.JSONDecodeError:
+            return super().from_payload(payload, type_hint)
+        if type_hint:
+            obj = value_to_type(type_hint, obj, self._custom_type_converters)
+        return obj
+
+
+# 19 digits in a row may be an integer past orjson's 64-bit range
+_MAYBE_BIG_INT = re.compile(rb"\d{19}")
+
+
+def _may_hold_non_finite(value: Any) -> bool:
+    """Whether value contains NaN or an infinity; True for anything not plain JSON."""
+    if value is None or isinstance(value, (str, int)):
+        return False
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(map(_may_hold_non_finite, value.values()))
+    if isinstance(value, (list, tuple)):
+        return any(map(_may_hold_non_finite, value))
+    return True
+
+
+class OrjsonPayloadConverter(CompositePayloadConverter):
+    """DefaultPayloadConverter with its JSON step swapped for OrjsonPlainPayloadConverter."""
+
+    def __init__(self) -> None:
+        super().__init__(*(
+            OrjsonPlainPayloadConverter() if isinstance(c, JSONPlainPayloadConverter) else c
+            for c in DefaultPayloadConverter.default_encoding_payload_converters
+        ))
+
+
+DATA_CONVERTER = dataclasses.replace(DataConverter.default, payload_converter_class=OrjsonPayloadConverter)
+
+
+async def get_temporal_client() -> Client:
+    """Connect on first use; later calls share the same gRPC channel."""
+    global _client
+    if _client is None:
+        async with _lock:
+            if _client is None:
+                _client = await Client.connect(
+                    settings.temporal_address,
+                    namespace=settings.temporal_namespace,
+                    data_converter=DATA_CONVERTER,
+                )
+    return _client
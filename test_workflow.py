@@ -4,13 +4,13 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent))
 
-from temporalio.client import Client
 from workflows.order_workflow import OrderWorkflow
 from config import settings
+from temporal_client import get_temporal_client
 import uuid
 
 async def main():
-    client = await Client.connect(settings.temporal_address)
+    client = await get_temporal_client()
     
     order_id = f"order-{uuid.uuid4().hex[:8]}"
     payment_id = f"pay-{uuid.uuid4().hex[:8]}"
@@ -0,0 +1,67 @@
+"""Round trips between the orjson payload converter and the SDK's stock one."""
+import asyncio
+import dataclasses
+
+import pytest
+from temporalio.converter import JSONPlainPayloadConverter
+
+from temporal_client import DATA_CONVERTER, OrjsonPlainPayloadConverter
+
+
+@dataclasses.dataclass
+class Item:
+    sku_id: int
+    name: str
+    qty: int = 1
+
+
+# Dict keys in sorted order, as both converters write them
+VALUES = [
+    {"address": None, "items": [{"qty": 2, "sku_id": 1}], "order_id": "o-1"},
+    [float("nan")],
+    {"a": float("nan"), "b": None},
+    [float("inf"), float("-inf")],
+    {"sku_id": 2**70},
+    -(2**63) - 1,
+    2**64 - 1,
+    {"name": "café ✓"},
+    "\ud800",
+    {"amount": 1e16, "tiny": 1e-7},
+]
+
+CONVERTERS = [
+    pytest.param(JSONPlainPayloadConverter(), OrjsonPlainPayloadConverter(), id="stock-to-orjson"),
+    pytest.param(OrjsonPlainPayloadConverter(), JSONPlainPayloadConverter(), id="orjson-to-stock"),
+    pytest.param(OrjsonPlainPayloadConverter(), OrjsonPlainPayloadConverter(), id="orjson-to-orjson"),
+]
+
+
+@pytest.mark.parametrize("writer,reader", CONVERTERS)
+@pytest.mark.parametrize("value", VALUES, ids=repr)
+def test_round_trip(writer, reader, value):
+    decoded = reader.from_payload(writer.to_payload(value))
+    # repr, so NaN compares equal and an int read back as a float does not
+    assert repr(decoded) == repr(value)
+
+
+@pytest.mark.parametrize("writer,reader", CONVERTERS)
+def test_round_trip_dataclass(writer, reader):
+    item = Item(sku_id=2**70, name="café")
+    assert reader.from_payload(writer.to_payload(item), Item) == item
+
+
+@pytest.mark.parametrize("value", VALUES, ids=repr)
+def test_same_bytes_as_stock(value):
+    # Only float exponents may differ, and they decode to the same value
+    if isinstance(value, dict) and "amount" in value:
+        pytest.skip("float exponent formatting differs")
+    assert OrjsonPlainPayloadConverter().to_payload(value).data == JSONPlainPayloadConverter().to_payload(value).data
+
+
+def test_data_converter_round_trip():
+    values = [float("nan"), {"sku_id": 2**70}, "\ud800"]
+
+    async def round_trip():
+        return await DATA_CONVERTER.decode(await DATA_CONVERTER.encode(values))
+
+    assert repr(asyncio.run(round_trip())) == repr(values)
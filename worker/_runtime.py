@@ -0,0 +1,38 @@
+"""Process setup shared by the worker entry points."""
+import asyncio
+import logging
+import signal
+from typing import Any, Callable, Coroutine
+
+logger = logging.getLogger(__name__)
+
+# Workflows bind order_id onto their records; other loggers fall back to "-"
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s [order=%(order_id)s] %(message)s"
+
+
+def run_worker(main: Callable[[], Coroutine[Any, Any, None]]) -> None:
+    """Configure logging and the event loop, then run main() to completion."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, defaults={"order_id": "-"}))
+    logging.basicConfig(level=logging.INFO, handlers=[handler])
+    try:
+        import uvloop  # not available on Windows
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    asyncio.run(_serve(main))
+
+
+async def _serve(main: Callable[[], Coroutine[Any, Any, None]]) -> None:
+    # docker stop sends SIGTERM, whose default handler exits without running
+    # main()'s cleanup; cancel main() instead, as asyncio.run does on Ctrl-C,
+    # so the worker shuts down and the event writer is drained
+    task = asyncio.current_task()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    except NotImplementedError:  # not available on Windows
+        pass
+    try:
+        await main()
+    except asyncio.CancelledError:
+        logger.info("Worker stopped")
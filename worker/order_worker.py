@@ -1,12 +1,12 @@
-import asyncio
 import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from temporalio.client import Client
 from temporalio.worker import Worker
 from config import settings
+from worker._runtime import run_worker
+from temporal_client import get_temporal_client
 from workflows.order_workflow import OrderWorkflow
 from activities.activities import (
     order_received,
@@ -16,23 +16,35 @@ from activities.activities import (
     update_order_address,
 )
 from db.session import init_db_pool, init_schema
+from db.bootstrap import create_database
+from db.event_writer import start_event_writer, close_event_writer
 
 async def main():
-    await init_db_pool()
+    if settings.db_bootstrap:
+        await create_database()
+    # Regular and local activities are limited separately and share the pool
+    await init_db_pool(2 * settings.db_pool_size)
     await init_schema()
+    await start_event_writer()
 
     print("Database initialized")
 
     
-    client = await Client.connect(settings.temporal_address) # connection to temporal server so localhost:7233
+    client = await get_temporal_client()
     worker = Worker(
         client,
         task_queue=settings.order_tq,
         workflows=[OrderWorkflow],  # workflows.order_workflow logic here
         activities=[order_received, order_validated, payment_charged, order_shipped, update_order_address],
+        # one pooled connection per running activity, of either kind
+        max_concurrent_activities=settings.db_pool_size,
+        max_concurrent_local_activities=settings.db_pool_size,
     )
     print("Order Worker is starting...")
-    await worker.run()
+    try:
+        await worker.run()
+    finally:
+        await close_event_writer()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    run_worker(main)
@@ -1,29 +1,40 @@
-import asyncio
 import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from temporalio.client import Client
 from temporalio.worker import Worker
 from config import settings
+from worker._runtime import run_worker
+from temporal_client import get_temporal_client
 from workflows.shipping_workflow import ShippingWorkflow
 from activities.activities import (
     package_prepared,
     carrier_dispatched,
-    order_shipped,
 )
+from db.session import init_db_pool
+from db.bootstrap import create_database
+from db.event_writer import start_event_writer, close_event_writer
 
 async def main():
-    client = await Client.connect(settings.temporal_address) 
+    if settings.db_bootstrap:
+        await create_database()
+    await init_db_pool()
+    await start_event_writer()
+
+    client = await get_temporal_client()
     worker = Worker(
         client,
         task_queue=settings.shipping_tq,
         workflows=[ShippingWorkflow],  
-        activities=[package_prepared, carrier_dispatched, order_shipped],
+        activities=[package_prepared, carrier_dispatched],
+        max_concurrent_activities=settings.db_pool_size,  # one pooled connection per running activity
     )
     print("Shipping Worker is starting...")
-    await worker.run()
+    try:
+        await worker.run()
+    finally:
+        await close_event_writer()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run_worker(main)
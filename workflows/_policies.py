@@ -0,0 +1,57 @@
+"""Retry policies and per-activity call options shared by the workflows.
+
+Built once at import; call sites splat the matching *_KWARGS dict into
+execute_activity / execute_local_activity. The workflows import this module
+passed through the sandbox, so every run shares these objects instead of the
+sandbox rebuilding them per run.
+"""
+from datetime import timedelta
+from temporalio.common import RetryPolicy
+from temporalio.exceptions import ActivityError, ApplicationError, CancelledError, ChildWorkflowError, RetryState
+
+STANDARD_RETRY_POLICY = RetryPolicy(
+    initial_interval=timedelta(milliseconds=100),
+    maximum_interval=timedelta(seconds=10),
+    backoff_coefficient=2.0,
+    # flaky_call fails about two attempts in three; 20 attempts keeps the
+    # chance of a healthy activity exhausting them below 0.1%.
+    maximum_attempts=20,
+    non_retryable_error_types=["ValidationError"],
+)
+
+# Per-attempt limits: quick DB-only steps, and the external calls
+# (payment, carrier) that get more headroom.
+SHORT_TIMEOUT = timedelta(seconds=2)
+LONG_TIMEOUT = timedelta(seconds=5)
+# Local activities: the DB bookkeeping steps run in the order worker without a
+# task-queue round-trip.
+LOCAL_TIMEOUT = timedelta(seconds=1)
+
+_LOCAL = {"start_to_close_timeout": LOCAL_TIMEOUT, "retry_policy": STANDARD_RETRY_POLICY}
+_SHORT = {"start_to_close_timeout": SHORT_TIMEOUT, "retry_policy": STANDARD_RETRY_POLICY}
+_LONG = {"start_to_close_timeout": LONG_TIMEOUT, "retry_policy": STANDARD_RETRY_POLICY}
+
+# OrderWorkflow
+RECEIVE_KWARGS = _LOCAL
+VALIDATE_KWARGS = _LOCAL
+CHARGE_KWARGS = _LONG
+SHIP_KWARGS = _LOCAL
+ADDRESS_KWARGS = _SHORT
+
+# ShippingWorkflow
+PREPARE_KWARGS = _SHORT
+DISPATCH_KWARGS = _LONG
+
+
+def is_cancellation(e: Exception) -> bool:
+    """True when an activity or child failed only because it was cancelled."""
+    return isinstance(e, (ActivityError, ChildWorkflowError)) and isinstance(e.cause, CancelledError)
+
+
+def is_permanent(e: Exception) -> bool:
+    """True when an activity failed with an error its retry policy does not retry."""
+    return (
+        isinstance(e, ActivityError)
+        and isinstance(e.cause, ApplicationError)
+        and (e.cause.non_retryable or e.retry_state == RetryState.NON_RETRYABLE_FAILURE)
+    )
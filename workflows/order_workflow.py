@@ -1,9 +1,21 @@
+import asyncio
+import logging
+from collections import deque
 from temporalio import workflow
-from temporalio.common import RetryPolicy
+from temporalio.exceptions import ApplicationError
 from datetime import timedelta
 from typing import Dict, Any
 
 with workflow.unsafe.imports_passed_through():
+    from workflows._policies import (
+        RECEIVE_KWARGS,
+        VALIDATE_KWARGS,
+        CHARGE_KWARGS,
+        SHIP_KWARGS,
+        ADDRESS_KWARGS,
+        is_cancellation,
+        is_permanent,
+    )
     from activities.activities import (
         order_received,
         order_validated,
@@ -12,130 +24,213 @@ with workflow.unsafe.imports_passed_through():
         update_order_address,
     )
     from config import settings
+    from workflows.shipping_workflow import ShippingWorkflow
+
+# Address signals arriving within this window are written to the DB once,
+# with the latest address.
+ADDRESS_DEBOUNCE = timedelta(seconds=1)
+
+# Manual review has this long to approve, measured from the first time the
+# order starts waiting (carried across continue-as-new)
+APPROVAL_TIMEOUT = timedelta(seconds=300)
+
+# While awaiting approval, continue-as-new once history grows past this many
+# events, so a burst of signals cannot make replay arbitrarily slow
+_HISTORY_LIMIT = 5000
 
-STANDARD_RETRY_POLICY = RetryPolicy(
-    initial_interval=timedelta(milliseconds=5),
-    maximum_interval=timedelta(milliseconds=200),
-    backoff_coefficient=1.0,
-    maximum_attempts=1000,
-)
+# Errors kept for the status query
+_MAX_ERRORS = 32
 
-STANDARD_TIMEOUT = timedelta(seconds=2)
+# Child workflow ID for an order's shipping
+_SHIPPING_ID_FMT = "shipping-{}".format
+
+# States in which cancel_order still takes effect (nothing charged yet)
+_CANCELLABLE_STATES = frozenset({"INIT", "RECEIVING", "VALIDATING", "AWAITING_APPROVAL"})
 
 @workflow.defn
 class OrderWorkflow:
+    __slots__ = (
+        "_state",
+        "_errors",
+        "_errors_snapshot",
+        "_address",
+        "_cancelled",
+        "_order_data",
+        "_manual_review_approved",
+        "_review_decided",
+        "_pending_address",
+        "_written_address",
+        "_log",
+    )
+
     def __init__(self):
         self._state = "INIT"
-        self._errors: list[str] = []
+        # Only the most recent errors are kept, so state stays bounded however
+        # often a workflow fails
+        self._errors: deque[str] = deque(maxlen=_MAX_ERRORS)
+        # Immutable copy for status(), refreshed by _add_error so the query
+        # neither copies nor touches workflow state
+        self._errors_snapshot: tuple[str, ...] = ()
         self._address: dict | None = None
         self._cancelled = False
         self._order_data: dict | None = None
         self._manual_review_approved = False
+        # Set by approve_order / cancel_order; the manual-review wait watches only this
+        self._review_decided = False
+        self._pending_address: dict | None = None
+        # Last address known to be in the DB; repeats of it are not re-written
+        self._written_address: dict | None = None
+        # Signals delivered with the first activation run before run() binds
+        # order_id, so start from the workflow ID, which the API sets to it
+        self._log = logging.LoggerAdapter(workflow.logger, {"order_id": workflow.info().workflow_id})
 
     @workflow.run
-    async def run(self, order_id: str, payment_id: str, items: list[dict], address: dict = None) -> Dict[str, Any]:
+    async def run(self, order_id: str, payment_id: str, items: list[dict], address: dict = None, resume: dict | None = None) -> Dict[str, Any]:
+        """`resume` is only set by continue-as-new from the approval wait."""
+        # Bound once so each record carries order_id for the worker's formatter
+        self._log = logging.LoggerAdapter(workflow.logger, {"order_id": order_id})
+        address_flusher = None
         try:
-            self._state = "RECEIVING"
             self._address = address
-            
-            workflow.logger.info(f"Starting OrderWorkflow for {order_id}")
-            order_data = {
-                "order_id": order_id,
-                "items": items,
-                "address": self._address
-            }
-            
-            order_result = await workflow.execute_activity(
-                order_received,
-                order_data,
-                start_to_close_timeout=STANDARD_TIMEOUT,
-                retry_policy=STANDARD_RETRY_POLICY,
-            )
-            
-            self._order_data = order_result
-            workflow.logger.info(f"Order {order_id} received")
-            
-            if self._cancelled:
-                self._state = "CANCELLED"
-                workflow.logger.info(f"Order {order_id} cancelled after receiving")
-                return {"status": "cancelled", "order_id": order_id}
-            
-            self._state = "VALIDATING"
-            workflow.logger.info(f"Validating order {order_id}")
-            
-            validation_result = await workflow.execute_activity(
-                order_validated,
-                self._order_data,
-                start_to_close_timeout=STANDARD_TIMEOUT,
-                retry_policy=STANDARD_RETRY_POLICY,
-            )
-            
-            workflow.logger.info(f"Order {order_id} validated: {validation_result}")
-            
-            if self._cancelled:
-                self._state = "CANCELLED"
-                workflow.logger.info(f"Order {order_id} cancelled after validation")
-                return {"status": "cancelled", "order_id": order_id}
+            if resume is not None:
+                self._log.info("Resuming OrderWorkflow at manual approval")
+                self._order_data = {"order_id": order_id}
+                self._written_address = resume["written_address"]
+                for error in resume["errors"]:
+                    self._add_error(error)
+                address_flusher = asyncio.create_task(self._address_flusher(order_id))
+                approval_deadline = resume["approval_deadline"]
+            else:
+                self._state = "RECEIVING"
+                self._log.info("Starting OrderWorkflow")
+                # Checked here rather than in an activity: the input is in
+                # history, so this is deterministic and fails fast. The
+                # address may be omitted and signalled later.
+                if not items or not (address is None or isinstance(address, dict)):
+                    raise ApplicationError("Invalid order: items must be non-empty and address a dict", type="ValidationError", non_retryable=True)
+                order_data = {
+                    "order_id": order_id,
+                    "items": items,
+                    "address": self._address
+                }
+                
+                order_result = await workflow.execute_local_activity(
+                    order_received,
+                    order_data,
+                    **RECEIVE_KWARGS,
+                )
+                self._written_address = order_result.get("address")
+                # An update_address signal during order_received only changed
+                # self._address; queue it so the flusher writes it
+                if self._address is not None and self._address != self._written_address:
+                    self._pending_address = self._address
+                
+                # The order is persisted now; downstream steps only need its ID and
+                # read items back from the DB, keeping them out of workflow history.
+                self._order_data = {"order_id": order_id}
+                self._log.info("Order received")
+                address_flusher = asyncio.create_task(self._address_flusher(order_id))
+                
+                if self._cancelled:
+                    self._state = "CANCELLED"
+                    self._log.info("Order cancelled after receiving")
+                    await self._drain_address()
+                    return {"status": "cancelled", "order_id": order_id}
+                
+                self._state = "VALIDATING"
+                
+                validation_result = await workflow.execute_local_activity(
+                    order_validated,
+                    self._order_data,
+                    **VALIDATE_KWARGS,
+                )
+                
+                self._log.info("Order validated: %s", validation_result)
+                
+                if self._cancelled:
+                    self._state = "CANCELLED"
+                    self._log.info("Order cancelled after validation")
+                    await self._drain_address()
+                    return {"status": "cancelled", "order_id": order_id}
+                
+                approval_deadline = workflow.now().timestamp() + APPROVAL_TIMEOUT.total_seconds()
             
             self._state = "AWAITING_APPROVAL"
-            workflow.logger.info(f"Order {order_id} awaiting manual approval")
+            self._log.info("Order awaiting manual approval")
             
-            await workflow.wait_condition(
-                lambda: self._manual_review_approved or self._cancelled,
-                timeout=timedelta(seconds=300)
-            )
+            try:
+                await workflow.wait_condition(
+                    lambda: self._review_decided or workflow.info().get_current_history_length() > _HISTORY_LIMIT,
+                    # Floor of 1ms: a zero timeout would fail even if the review
+                    # was decided by a signal delivered with this activation
+                    timeout=max(approval_deadline - workflow.now().timestamp(), 0.001)
+                )
+            except asyncio.TimeoutError:
+                self._state = "APPROVAL_TIMEOUT"
+                self._log.error("Order manual approval timeout")
+                raise ApplicationError("Manual approval not received within timeout period", type="ManualApprovalTimeout", non_retryable=True)
+            
+            if not self._review_decided:
+                # History limit reached: flush the address, then start a fresh
+                # run that picks up the wait with the same deadline
+                await self._drain_address()
+                if not self._review_decided:
+                    workflow.continue_as_new(args=[
+                        order_id,
+                        payment_id,
+                        [],  # already persisted; a resumed run reads nothing but the ID
+                        self._address,
+                        {
+                            "approval_deadline": approval_deadline,
+                            "written_address": self._written_address,
+                            "errors": list(self._errors),
+                        },
+                    ])
             
             if self._cancelled:
                 self._state = "CANCELLED"
-                workflow.logger.info(f"Order {order_id} cancelled during manual review")
+                self._log.info("Order cancelled during manual review")
+                await self._drain_address()
                 return {"status": "cancelled", "order_id": order_id}
             
-            if not self._manual_review_approved:
-                self._state = "APPROVAL_TIMEOUT"
-                workflow.logger.error(f"Order {order_id} manual approval timeout")
-                raise TimeoutError("Manual approval not received within timeout period")
-            
-            workflow.logger.info(f"Order {order_id} manually approved")
+            self._log.info("Order manually approved")
             
             self._state = "CHARGING_PAYMENT"
-            workflow.logger.info(f"Charging payment for order {order_id}")
-            
-            self._order_data["address"] = self._address
             
             payment_result = await workflow.execute_activity(
                 payment_charged,
                 args=[self._order_data, payment_id],
-                start_to_close_timeout=STANDARD_TIMEOUT,
-                retry_policy=STANDARD_RETRY_POLICY,
+                **CHARGE_KWARGS,
             )
             
-            workflow.logger.info(f"Payment charged for order {order_id}: {payment_result}")
+            self._log.info("Payment charged: %s", payment_result)
             
             self._state = "SHIPPING"
-            workflow.logger.info(f"Starting shipping workflow for order {order_id}")
-            
-            from workflows.shipping_workflow import ShippingWorkflow
             
             shipping_handle = await workflow.start_child_workflow(
                 ShippingWorkflow.run,
                 self._order_data,
-                id=f"shipping-{order_id}",
+                id=_SHIPPING_ID_FMT(order_id),
                 task_queue=settings.shipping_tq,
             )
             
             shipping_result = await shipping_handle
-            workflow.logger.info(f"Shipping completed for order {order_id}: {shipping_result}")
+            self._log.info("Shipping completed: %s", shipping_result)
             
+            # Deliberately not run alongside the child: each shipping activity
+            # advances orders.state, so recording ORDER_SHIPPED concurrently
+            # could be overwritten by PACKAGE_PREPARED/CARRIER_DISPATCHED, and
+            # would mark an order shipped even when dispatch fails.
             self._state = "SHIPPED"
-            await workflow.execute_activity(
+            await workflow.execute_local_activity(
                 order_shipped,
                 self._order_data,
-                start_to_close_timeout=STANDARD_TIMEOUT,
-                retry_policy=STANDARD_RETRY_POLICY,
+                **SHIP_KWARGS,
             )
             
+            await self._drain_address()
             self._state = "COMPLETED"
-            workflow.logger.info(f"Order {order_id} workflow completed")
+            self._log.info("Order workflow completed")
             
             return {
                 "status": "completed",
@@ -144,59 +239,104 @@ class OrderWorkflow:
                 "shipping": shipping_result,
             }
             
+        except asyncio.CancelledError:
+            # The workflow itself was cancelled; not an order failure, so
+            # nothing goes into _errors
+            self._state = "CANCELLED"
+            self._log.info("Order workflow cancelled")
+            raise
         except Exception as e:
-            self._state = "FAILED"
+            if is_cancellation(e):
+                self._state = "CANCELLED"
+                self._log.info("Order workflow cancelled: %s", e)
+                raise
+            # An approval timeout keeps its own state for the status query
+            if self._state != "APPROVAL_TIMEOUT":
+                self._state = "FAILED"
             error_msg = f"Workflow failed: {str(e)}"
-            self._errors.append(error_msg)
-            workflow.logger.error(f"Order {order_id} workflow failed: {e}")
+            self._add_error(error_msg)
+            if is_permanent(e):
+                self._log.error("Order workflow failed permanently: %s", e.cause)
+                # Surfaced non-retryable under the activity's error type, so
+                # callers can tell a rejected order from an outage without
+                # unwrapping the activity failure
+                raise ApplicationError(e.cause.message, type=e.cause.type, non_retryable=True) from e
+            self._log.error("Order workflow failed: %s", e)
             raise
+        finally:
+            if address_flusher is not None:
+                address_flusher.cancel()
+
+    async def _address_flusher(self, order_id: str):
+        """Write the latest signalled address once each debounce window."""
+        while True:
+            await workflow.wait_condition(lambda: self._pending_address is not None)
+            await asyncio.sleep(ADDRESS_DEBOUNCE.total_seconds())
+            address = self._pending_address
+            try:
+                await workflow.execute_activity(
+                    update_order_address,
+                    args=[order_id, address],
+                    **ADDRESS_KWARGS,
+                )
+                self._written_address = address
+                self._log.info("Address updated in DB")
+            except Exception as e:
+                self._log.error("Failed to update address in DB: %s", e)
+                self._add_error(f"Address update failed: {str(e)}")
+            # A signal that arrived during the write leaves a newer address pending
+            if self._pending_address is address:
+                self._pending_address = None
+
+    def _add_error(self, message: str):
+        self._errors.append(message)
+        self._errors_snapshot = tuple(self._errors)
+
+    async def _drain_address(self):
+        """Wait for any pending address write before the workflow finishes."""
+        await workflow.wait_condition(lambda: self._pending_address is None)
 
     @workflow.signal
     async def cancel_order(self):
-        workflow.logger.info(f"Cancel signal received, current state: {self._state}")
-        if self._state in ["INIT", "RECEIVING", "VALIDATING", "AWAITING_APPROVAL"]:
+        self._log.info("Cancel signal received, current state: %s", self._state)
+        if self._state in _CANCELLABLE_STATES:
             self._cancelled = True
-            workflow.logger.info("Order marked for cancellation")
+            self._review_decided = True
+            self._log.info("Order marked for cancellation")
         else:
-            workflow.logger.warning(f"Cannot cancel order in state: {self._state}")
+            self._log.warning("Cannot cancel order in state: %s", self._state)
 
     @workflow.signal
     async def update_address(self, address: dict):
-        workflow.logger.info(f"Address update signal received: {address}")
+        self._log.info("Address update signal received: %s", address)
         self._address = address
         if self._order_data:
-            self._order_data["address"] = address
-            
-            try:
-                await workflow.execute_activity(
-                    update_order_address,
-                    args=[self._order_data["order_id"], address],
-                    start_to_close_timeout=STANDARD_TIMEOUT,
-                    retry_policy=STANDARD_RETRY_POLICY,
-                )
-                workflow.logger.info("Address updated in DB")
-            except Exception as e:
-                workflow.logger.error(f"Failed to update address in DB: {e}")
-                self._errors.append(f"Address update failed: {str(e)}")
+            # Plain dict equality rather than hash(): str hashes are salted per
+            # process, so they would not be deterministic across workers.
+            if address == (self._pending_address if self._pending_address is not None else self._written_address):
+                self._log.info("Address unchanged; skipping DB update")
+                return
+            self._pending_address = address
         else:
-            workflow.logger.info("Address updated in workflow state (order not yet created)")
+            self._log.info("Address updated in workflow state (order not yet created)")
 
     @workflow.signal
     async def approve_order(self):
-        workflow.logger.info("Manual approval signal received")
+        self._log.info("Manual approval signal received")
         self._manual_review_approved = True
+        self._review_decided = True
 
     @workflow.signal
     async def dispatch_failed(self, reason: str):
-        workflow.logger.error(f"Dispatch failed signal received: {reason}")
-        self._errors.append(f"Dispatch failed: {reason}")
+        self._log.error("Dispatch failed signal received: %s", reason)
+        self._add_error(f"Dispatch failed: {reason}")
 
     @workflow.query
     def status(self) -> dict:
         return {
             "state": self._state,
             "address": self._address,
-            "errors": list(self._errors),
+            "errors": self._errors_snapshot,
             "cancelled": self._cancelled,
             "manual_review_approved": self._manual_review_approved,
         }
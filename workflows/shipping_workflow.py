@@ -1,57 +1,50 @@
+import asyncio
+import logging
 from temporalio import workflow
-from temporalio.common import RetryPolicy
-from datetime import timedelta
 from typing import Dict, Any
 
 with workflow.unsafe.imports_passed_through():
+    from workflows._policies import PREPARE_KWARGS, DISPATCH_KWARGS, is_cancellation
     from activities.activities import (
         package_prepared,
         carrier_dispatched,
     )
 
-STANDARD_RETRY_POLICY = RetryPolicy(
-    initial_interval=timedelta(milliseconds=5),
-    maximum_interval=timedelta(milliseconds=200),
-    backoff_coefficient=1.0,
-    maximum_attempts=1000,
-)
-
-STANDARD_TIMEOUT = timedelta(seconds=2)
-
 @workflow.defn
 class ShippingWorkflow:
+    __slots__ = ("_state",)
+
     def __init__(self):
         self._state = "INIT"
 
     @workflow.run
     async def run(self, order: dict) -> Dict[str, Any]:
         order_id = order.get("order_id")
+        log = logging.LoggerAdapter(workflow.logger, {"order_id": order_id})
         
         try:
             self._state = "PREPARING"
-            workflow.logger.info(f"Preparing package for order {order_id}")
             
             package_result = await workflow.execute_activity(
                 package_prepared,
                 order,
-                start_to_close_timeout=STANDARD_TIMEOUT,
-                retry_policy=STANDARD_RETRY_POLICY,
+                **PREPARE_KWARGS,
             )
             
-            workflow.logger.info(f"Package prepared for order {order_id}: {package_result}")
+            log.info("Package prepared: %s", package_result)
             
+            # Dispatch needs the prepared package, and both steps advance
+            # orders.state, so they stay sequential.
             self._state = "DISPATCHING"
-            workflow.logger.info(f"Dispatching carrier for order {order_id}")
             
             try:
                 dispatch_result = await workflow.execute_activity(
                     carrier_dispatched,
                     order,
-                    start_to_close_timeout=STANDARD_TIMEOUT,
-                    retry_policy=STANDARD_RETRY_POLICY,
+                    **DISPATCH_KWARGS,
                 )
                 
-                workflow.logger.info(f"Carrier dispatched for order {order_id}: {dispatch_result}")
+                log.info("Carrier dispatched: %s", dispatch_result)
                 
                 self._state = "DISPATCHED"
                 return {
@@ -62,22 +55,31 @@ class ShippingWorkflow:
                 }
                 
             except Exception as dispatch_error:
-                workflow.logger.error(f"Dispatch failed for order {order_id}: {dispatch_error}")
+                if is_cancellation(dispatch_error):
+                    raise
+                log.error("Dispatch failed: %s", dispatch_error)
                 
-                parent_workflow_id = workflow.info().parent.workflow_id if workflow.info().parent else None
+                parent = workflow.info().parent
                 
-                if parent_workflow_id:
-                    workflow.logger.info(f"Signaling parent workflow {parent_workflow_id} about dispatch failure")
-                    from workflows.order_workflow import OrderWorkflow
+                if parent:
+                    log.info("Signaling parent workflow %s about dispatch failure", parent.workflow_id)
                     
-                    parent_handle = workflow.get_external_workflow_handle(parent_workflow_id)
-                    await parent_handle.signal(OrderWorkflow.dispatch_failed, f"Carrier dispatch failed: {str(dispatch_error)}")
+                    # Signalled by name: order_workflow imports this module, so
+                    # importing OrderWorkflow here would be circular.
+                    parent_handle = workflow.get_external_workflow_handle(parent.workflow_id)
+                    await parent_handle.signal("dispatch_failed", f"Carrier dispatch failed: {str(dispatch_error)}")
                 
                 raise
                 
+        except asyncio.CancelledError:
+            self._state = "CANCELLED"
+            raise
         except Exception as e:
+            if is_cancellation(e):
+                self._state = "CANCELLED"
+                raise
             self._state = "FAILED"
-            workflow.logger.error(f"Shipping workflow failed for order {order_id}: {e}")
+            log.error("Shipping workflow failed: %s", e)
             raise
 
     @workflow.query